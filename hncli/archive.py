@@ -0,0 +1,211 @@
+'''
+Offline archive of Hacker News pages.
+
+Pages are stored as zlib-compressed blobs named after SHA-1 of their
+content (so identical pages are kept only once), while an index file
+maps page URLs to blobs. The archive can be filled by mirroring
+the site and then used by Client in place of the network.
+'''
+import os
+import json
+import time
+import zlib
+import hashlib
+from urlparse import urlsplit
+
+import requests
+
+from .hn import PageUnavailable
+
+
+DEFAULT_PATH = os.path.expanduser(os.path.join('~', '.hncli', 'archive'))
+
+
+class Archive(object):
+    ''' Content-addressed archive of HN pages stored in a directory. '''
+    INDEX_FILE = 'index.json'
+    OBJECTS_DIR = 'objects'
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.index = {}     # page key -> (content hash, time archived)
+        self._dirty = False
+
+        index_file = os.path.join(path, self.INDEX_FILE)
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                self.index = dict((k, tuple(v))
+                                  for k, v in json.load(f).iteritems())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url):
+        return self.key(url) in self.index
+
+    @staticmethod
+    def key(url):
+        ''' Converts page URL into key used by the archive index,
+        which is independent of the host the page came from.
+        '''
+        parts = urlsplit(url)
+        key = parts.path or '/'
+        if parts.query:
+            key += '?' + parts.query
+        return key
+
+    def _object_path(self, digest):
+        return os.path.join(self.path, self.OBJECTS_DIR,
+                            digest[:2], digest[2:])
+
+    def get(self, url):
+        ''' Returns archived content of given page as a tuple:
+        (unicode string, time when it was archived),
+        or None if the page isn't in the archive.
+        '''
+        entry = self.index.get(self.key(url))
+        if entry is None:
+            return None
+        digest, archived_at = entry
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                text = zlib.decompress(f.read()).decode('utf-8')
+        except (IOError, zlib.error):
+            return None     # blob is missing or damaged
+        return text, archived_at
+
+    def put(self, url, content):
+        ''' Stores content of given page in the archive.
+        Index has to be saved afterwards to make it permanent.
+        '''
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        digest = hashlib.sha1(content).hexdigest()
+
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            object_dir = os.path.dirname(object_path)
+            if not os.path.isdir(object_dir):
+                os.makedirs(object_dir)
+            tmp_path = object_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(content))
+            os.rename(tmp_path, object_path)
+
+        self.index[self.key(url)] = (digest, int(time.time()))
+        self._dirty = True
+
+    def save(self):
+        ''' Writes the archive index to disk, if it has changed. '''
+        if not self._dirty:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        index_file = os.path.join(self.path, self.INDEX_FILE)
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f)
+        os.rename(tmp_file, index_file)
+        self._dirty = False
+
+
+class ArchivedResponse(object):
+    ''' Response object returned by ArchiveTransport,
+    mimicking the relevant part of python-requests' Response.
+    `fetched_at` is the time when the page was archived, which Client
+    uses instead of the current time to resolve relative times on it.
+    '''
+    def __init__(self, url, text=None, status_code=200, reason="OK",
+                 fetched_at=None):
+        self.url = url
+        self.text = text or u''
+        self.status_code = status_code
+        self.reason = reason
+        self.cookies = {}
+        self.fetched_at = fetched_at
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+
+class ArchiveTransport(object):
+    ''' Transport for Client which serves pages from the archive,
+    without accessing the network at all.
+    '''
+    def __init__(self, archive):
+        self.archive = archive
+
+    def request(self, method, url, **kwargs):
+        if method != 'get':
+            return ArchivedResponse(url, status_code=405,
+                                    reason="not available offline")
+        archived = self.archive.get(url)
+        if archived is None:
+            return ArchivedResponse(url, status_code=404,
+                                    reason="page not in archive")
+        text, archived_at = archived
+        return ArchivedResponse(url, text, fetched_at=archived_at)
+
+
+class RecordingTransport(object):
+    ''' Transport which passes requests to another one,
+    putting every successfully retrieved page in the archive.
+    '''
+    def __init__(self, transport, archive):
+        self.transport = transport
+        self.archive = archive
+
+    def request(self, method, url, **kwargs):
+        resp = self.transport.request(method, url, **kwargs)
+        if method == 'get' and resp.status_code == 200:
+            self.archive.put(url, resp.text)
+        return resp
+
+
+def mirror(client, archive, pages, comments=True, progress=None):
+    ''' Downloads given listing pages (e.g. '/news') into the archive,
+    along with the comment pages of all their stories, using the client.
+    `progress` is an optional callback invoked with URL of each page
+    once it has been archived.
+    Pages that fail to download are skipped, so that a flaky connection
+    doesn't abort the whole mirror.
+    Returns a tuple: (number of pages archived, list of (URL, error
+    message) pairs for pages which failed).
+    '''
+    transport = client.transport
+    client.transport = RecordingTransport(transport, archive)
+    count, failed = 0, []
+
+    def fetch(url, func, *args):
+        try:
+            result = func(*args)
+        except PageUnavailable, e:
+            failed.append((url, e.reason))
+            return None
+        except requests.RequestException, e:
+            failed.append((url, str(e)))
+            return None
+        if progress:
+            progress(url)
+        return result
+
+    try:
+        for page in pages:
+            stories = fetch(page, lambda: list(client.get_stories(page)))
+            if stories is None:
+                continue
+            count += 1
+            if not comments:
+                continue
+            for story in stories:
+                if story.job_post:
+                    continue
+                if fetch(story.comments_url, client.get_comments,
+                         story.id) is not None:
+                    count += 1
+    finally:
+        client.transport = transport
+        archive.save()
+    return count, failed
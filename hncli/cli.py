@@ -6,22 +6,43 @@ import os
 import sys
 import re
 import getpass
+import threading
 import webbrowser
 
-from . import hn
-from .utils import cast, get_terminal_size, break_lines, long_input
+from . import hn, archive, render
+from .items import merge_comments
+from .completion import Completer
+from .query import parse_query, sort_stories, StoryIndex
+from .utils import cast, long_input, TimeIndex
 
 
 class HackerNews(cmd.Cmd):
     ''' Command-line shell for Hacker News. '''
     ROOT_DIRS = ['top', 'new', 'threads', 'comments', 'ask', 'jobs']
     ALL_STORIES_DIRS = ['all', 'stories', 's']
+    STORY_PAGES = {
+        'top': '/news',
+        'new': '/newest',
+        'ask': '/ask',
+        'jobs': '/jobs',
+    }
 
     def __init__(self, *args, **kwargs):
+        client = kwargs.pop('client', None)
+        renderer = kwargs.pop('renderer', render.PlainRenderer)
         cmd.Cmd.__init__(self, *args, **kwargs) # cmd.Cmd is old-style class!
-        self.hn_client = hn.Client()
+        self.hn_client = client or hn.Client()
+        self.renderer = renderer(self.stdout)
         self.story_dirs = {}    # root_dir -> list of IDs
         self.stories = {}       # story_id -> Story object
+        self.story_index = StoryIndex()     # secondary indexes of stories
+        self.comments = {}      # story_id -> list of top-level Comments
+        self.story_times = TimeIndex()      # Story objects by time
+        self.comment_times = TimeIndex()    # Comment objects by time
+        self.completer = Completer(self)
+        self._abs_paths = {}    # (pwd, path) -> absolute path
+        self._prefetched = {}   # ('stories', page) or ('comments', story_id)
+                                # -> result retrieved ahead of time
 
         self.pwd = "/"
         self.prompt = self._format_prompt()
@@ -57,6 +78,11 @@ class HackerNews(cmd.Cmd):
         based on current "directory".
         Does nothing if path is already absolute.
         '''
+        key = (self.pwd, path)
+        pwd = self._abs_paths.get(key)
+        if pwd is not None:
+            return pwd
+
         path = path.strip()
         if not path:
             path = '.'
@@ -67,6 +93,9 @@ class HackerNews(cmd.Cmd):
             pwd = os.path.join(self.pwd, path)
             pwd = os.path.normpath(pwd)
 
+        if len(self._abs_paths) > 1024:
+            self._abs_paths.clear()
+        self._abs_paths[key] = pwd
         return pwd
 
     def _get_story(self, path):
@@ -76,6 +105,8 @@ class HackerNews(cmd.Cmd):
         '''
         path = self._absolute_path(path)
         path = path.lstrip('/')
+        if '/' not in path:
+            return None
         directory, s = path.split('/', 1)
 
         # check whether it is a path with actual HN story ID
@@ -97,14 +128,129 @@ class HackerNews(cmd.Cmd):
         if count is not None:
             count = cast(int, count, default=10)
 
-        stories = self.hn_client.get_stories(page, count)
-        stories = list(stories)
+        stories = self._prefetched.pop(('stories', page), None)
+        if stories is None:
+            stories = self.hn_client.get_stories(page, count)
+        stories = list(stories)[:count]
+        self._remember_stories(stories)
+        return stories
 
-        # remember Story objects cache based on their IDs
+    def _remember_stories(self, stories):
+        ''' Puts given Story objects into the cache, based on their IDs,
+        and updates all the indexes of cached stories.
+        '''
         for story in stories:
             self.stories[story.id] = story
-
-        return stories
+            self.story_times.add(story.time, story.id, story)
+            self.story_index.add(story)
+        self.completer.add_stories(stories)
+
+    def _set_story_dir(self, directory, stories):
+        ''' Remembers stories listed in given directory, in order. '''
+        self.story_dirs[directory] = [s.id for s in stories]
+        self.completer.set_directory(directory, self.story_dirs[directory])
+
+    def _query_stories(self, paths, filters, sort_field=None,
+                       descending=False):
+        ''' Selects stories from given "directories" that match all
+        the filters, optionally sorting them by given field.
+        Stories are taken from the cache, so directories are only
+        fetched if they haven't been listed before.
+        '''
+        scope = set()
+        for path in paths:
+            directory = self._absolute_path(path).strip('/')
+            if directory in [''] + self.ALL_STORIES_DIRS:
+                scope = None    # all cached stories
+                break
+            if directory not in self.STORY_PAGES:
+                raise ValueError("not a story directory: " + path)
+            if directory not in self.story_dirs:
+                stories = self._retrieve_stories(self.STORY_PAGES[directory])
+                self._set_story_dir(directory, stories)
+            scope.update(self.story_dirs[directory])
+
+        ids = self.story_index.candidates(filters)
+        for f in filters:
+            time_ids = self._time_candidates(f)
+            if time_ids is not None:
+                ids = time_ids if ids is None else ids & time_ids
+        if scope is not None:
+            ids = scope if ids is None else ids & scope
+        if ids is None:
+            ids = self.stories.keys()
+
+        stories = [self.stories[story_id] for story_id in ids
+                   if all(f.matches(self.stories[story_id])
+                          for f in filters)]
+        if sort_field:
+            return sort_stories(stories, sort_field, descending)
+
+        # without explicit order, keep the order of listed directories
+        if scope is None:
+            return sort_stories(stories, 'id', descending=True)
+        order = {}
+        for path in paths:
+            directory = self._absolute_path(path).strip('/')
+            for story_id in self.story_dirs[directory]:
+                order.setdefault(story_id, len(order))
+        return sorted(stories, key=lambda s: order[s.id])
+
+    def _time_candidates(self, f):
+        ''' Returns set of IDs of stories that may match given time filter,
+        found with the time index, or None if the filter isn't about time.
+        '''
+        if f.field != 'time' or f.op not in ('=', '>', '>=', '<', '<='):
+            return None
+        start = f.value if f.op in ('=', '>', '>=') else None
+        end = f.value if f.op in ('=', '<', '<=') else None
+        return set(s.id for s in self.story_times.between(start, end))
+
+    def _story_paths(self, stories, paths):
+        ''' Finds paths under which given stories can be accessed,
+        preferring their positions within given directories, then within
+        other listed directories, and finally their IDs (e.g. /all/123).
+        Returns list of (path, story) pairs.
+        '''
+        dirs = [self._absolute_path(p).strip('/') for p in paths]
+        dirs += sorted(self.story_dirs)
+        positions = {}  # story_id -> path
+        for directory in reversed([d for d in dirs if d in self.story_dirs]):
+            story_ids = self.story_dirs[directory]
+            width = len(hex(max(len(story_ids) - 1, 0))[2:])
+            for i, story_id in enumerate(story_ids):
+                positions[story_id] = "/%s/%s" % (
+                    directory, hex(i)[2:].rjust(width, '0'))
+
+        all_dir = self.ALL_STORIES_DIRS[0]
+        return [(positions.get(s.id, "/%s/%s" % (all_dir, s.id)), s)
+                for s in stories]
+
+    def _retrieve_comments(self, story):
+        ''' Retrieves comments for given story, remembering them
+        in the cache and indexing them by time.
+        If the comments were retrieved before, the cached thread
+        is refreshed in place rather than replaced.
+        Returns a tuple: (top-level comments, CommentsDiff or None).
+        '''
+        fresh = self._prefetched.pop(('comments', story.id), None)
+        if fresh is None:
+            fresh = self.hn_client.get_comments(story.id)
+
+        comments = self.comments.get(story.id)
+        if comments is None:
+            comments = self.comments[story.id] = fresh
+            for top_level in comments:
+                for comment in top_level.walk():
+                    self.comment_times.add(comment.time, comment.id, comment)
+            return comments, None
+
+        diff = merge_comments(comments, fresh)
+        for comment in diff.removed:
+            self.comment_times.remove(comment.id)
+        for comment in diff.new:
+            self.comment_times.add(comment.time, comment.id, comment)
+        return comments, diff
 
 
     def do_cd(self, path):
@@ -118,65 +264,149 @@ class HackerNews(cmd.Cmd):
         ''' Lists items in current "directory". Depending on where
         we are, this can output several different types of results,
         including stories and comments.
+        Stories can be filtered and sorted with expressions such as
+        points>100, author=pg, title~python or sort:-comments_count,
+        also across several directories (e.g. ls top new points>50).
+        Such queries use stories already listed, without refetching.
         '''
         def ls(pwd):
             if pwd == '/':
-                return '\t'.join(self.ROOT_DIRS)
+                self.renderer.directories(self.ROOT_DIRS)
+                return
             pwd = pwd.lstrip('/')
             
             # handle root "directories"
-            story_pages = {
-                'top': '/news',
-                'new': '/newest',
-                'ask': '/ask',
-                'jobs': '/jobs',
-            }
-            if pwd in story_pages:
-                stories = self._retrieve_stories(story_pages[pwd])
-                self.story_dirs[pwd] = [s.id for s in stories]
-                return format_stories(stories)
+            if pwd in self.STORY_PAGES:
+                stories = self._retrieve_stories(self.STORY_PAGES[pwd])
+                self._set_story_dir(pwd, stories)
+                self.renderer.stories(stories)
+                return
 
             # handle stories, displaying their comments
-            story_dirs = story_pages.keys() + self.ALL_STORIES_DIRS
+            story_dirs = self.STORY_PAGES.keys() + self.ALL_STORIES_DIRS
             if any(pwd.startswith(sp + '/') for sp in story_dirs):
                 story = self._get_story('/' + pwd)
                 if not story:
-                    return "ls: cannot list items at this location"
-                comments = self.hn_client.get_comments(story.id)
+                    self.renderer.message(
+                        "ls: cannot list items at this location")
+                    return
+                comments, _ = self._retrieve_comments(story)
                 if not comments:
-                    print "ls: no comments for this story"
-                return format_comments(comments)
+                    self.renderer.message("ls: no comments for this story")
+                self.renderer.comments(comments)
+
+        try:
+            paths, filters, sort_field, descending = parse_query(args)
+        except ValueError, e:
+            self.renderer.message("ls: %s" % e)
+            return
+
+        if filters or sort_field or len(paths) > 1:
+            try:
+                stories = self._query_stories(paths or ['.'], filters,
+                                              sort_field, descending)
+            except ValueError, e:
+                self.renderer.message("ls: %s" % e)
+                return
+            self.renderer.story_results(
+                self._story_paths(stories, paths or ['.']))
+        else:
+            ls(self._absolute_path(paths[0] if paths else ''))
+
+    def do_refresh(self, path):
+        ''' Retrieves comments of given story again, showing only those
+        which are new, edited or moved since the story was last listed.
+        '''
+        story = self._get_story(path) if path.strip() else None
+        if not story:
+            self.renderer.message("refresh: could not find story " + path)
+            return
+
+        comments, diff = self._retrieve_comments(story)
+        if diff is None:
+            self.renderer.comments(comments)
+        elif not diff:
+            self.renderer.message("refresh: no new comments")
+        else:
+            self.renderer.comments_diff(diff)
+
+    def do_mirror(self, args):
+        ''' Downloads given story directories (all of them by default),
+        together with comments for their stories, into local archive
+        which can be browsed later with `hncli --offline`.
+        '''
+        dirs = args.split() or sorted(self.STORY_PAGES)
+        unknown = [d for d in dirs if d not in self.STORY_PAGES]
+        if unknown:
+            self.renderer.message(
+                "mirror: not a story directory: " + unknown[0])
+            return
 
-        pwd = self._absolute_path(args)
-        res = ls(pwd)
-        if res: print res
+        pages = [self.STORY_PAGES[d] for d in dirs]
+        def progress(url):
+            self.renderer.message("mirror: " + url)
+            self.renderer.flush()
+        count, failed = archive.mirror(self.hn_client, archive.Archive(),
+                                       pages, progress=progress)
+        self.renderer.message("mirror: %s page(s) archived in %s" % (
+            count, archive.DEFAULT_PATH))
+        if failed:
+            self.renderer.message("mirror: %s page(s) failed:" % len(failed))
+            for url, error in failed:
+                self.renderer.message("mirror: %s: %s" % (url, error))
+
+    def do_recent(self, minutes):
+        ''' Lists comments posted within given number of minutes
+        (10 by default), from all comment threads listed so far.
+        '''
+        minutes = cast(int, minutes.strip() or 10, default=None)
+        if minutes is None:
+            self.renderer.message("recent: invalid number of minutes")
+            return
+
+        comments = self.comment_times.since(minutes * 60)
+        if not comments:
+            self.renderer.message(
+                "recent: no comments from last %s minutes" % minutes)
+            return
+        self.renderer.comments(comments, recursive=False)
+
+    def do_output(self, name):
+        ''' Chooses how content is displayed: as plain text (default),
+        colored text, compact text with one line per item, or JSON.
+        '''
+        name = name.strip()
+        if name not in render.RENDERERS:
+            self.renderer.message("output: choose one of: " +
+                                  ", ".join(sorted(render.RENDERERS)))
+            return
+        self.renderer = render.RENDERERS[name](self.stdout)
 
     def do_su(self, user):
         ''' Login to Hacker News as given user. '''
         user = user.strip()
         if not user:
-            print "su: no username provided"
+            self.renderer.message("su: no username provided")
             return
         if self.hn_client.authenticated and user == self.hn_client.user_name:
-            print "su: you are already logged in as " + user
+            self.renderer.message("su: you are already logged in as " + user)
             return
 
         password = getpass.getpass()
         success = self.hn_client.login(user, password)
         if not success:
-            print "su: authentication failed."
+            self.renderer.message("su: authentication failed.")
 
     def do_open(self, s):
         ''' Opens given story in a browser.
         Story is identified by a path that includes
         "directory" name and a hexademical index, e.g. /top/1e.
         '''
-        pwd = self._absolute_path(s)[1:]
-        story = self._get_story(*pwd.split('/', 1))
+        story = self._get_story(s)
         if story:
             webbrowser.open(story.url)
         else:
-            print "open: unknown story: " + s
+            self.renderer.message("open: unknown story: " + s)
 
     def do_post(self, s):
         ''' Posts a comment to given story. It opens up a console text editor
@@ -185,28 +415,28 @@ class HackerNews(cmd.Cmd):
         '''
         story = self._get_story(s)
         if not story:
-            print "post: could not find story " + s
+            self.renderer.message("post: could not find story " + s)
             return
 
         if not self.hn_client.authenticated:
-            print "post: you cannot add comments as guest"
+            self.renderer.message("post: you cannot add comments as guest")
             return
 
         comment = long_input("Please enter your comment.")
         if not comment:
-            print "post: adding comment canceled"
+            self.renderer.message("post: adding comment canceled")
             return
 
         success = self.hn_client.post_comment(story.id, comment)
         if not success:
-            print "post: failed to post the comment"
+            self.renderer.message("post: failed to post the comment")
 
     def do_help(self, command):
         ''' Display help for given command. '''
         if command:
             help = self._help(command.strip())
             if help:
-                print help
+                self.renderer.message(help)
                 return
         cmd.Cmd.do_help(self, command)
 
@@ -215,6 +445,18 @@ class HackerNews(cmd.Cmd):
         sys.exit()
 
 
+    def _complete_path(self, text, line, begidx, endidx):
+        ''' Completes path argument of a command. '''
+        arg = line[:endidx].split(' ')[-1]
+        return self.completer.complete(arg, text)
+
+    complete_cd = _complete_path
+    complete_ls = _complete_path
+    complete_open = _complete_path
+    complete_post = _complete_path
+    complete_refresh = _complete_path
+
+
     def postcmd(self, stop, line):
         ''' Post-command hook. Modifies the prompt to show
         information about HN user, if any.
@@ -226,54 +468,97 @@ class HackerNews(cmd.Cmd):
         be multiple commands separated by && so we support it here.
         '''
         if not '&&' in line:
-            return cmd.Cmd.onecmd(self, line)
+            self.renderer.begin()
+            try:
+                return cmd.Cmd.onecmd(self, line)
+            except hn.PageUnavailable, e:
+                self.renderer.message("%s: %s" % (self.parseline(line)[0], e))
+                return None
+            finally:
+                self.renderer.flush()
 
         cmds = [s.strip() for s in line.split('&&')]
-        retvals = map(self.onecmd, cmds)
-        return retvals[-1]
-
-    def emptyline(self):
-        pass # do nothing (and don't repeat last command)
-
-
-## Displaying content
-
-def format_stories(stories):
-    ''' Formats a list Story objects, producing text output. '''
-    if not stories:
-        return ""
-
-    lines = []
-    number_width = len(hex(len(stories) - 1)[2:])   # for zero-padding
-    for i, story in enumerate(stories):
-        number = hex(i)[2:].rjust(number_width, '0') + ": "
-        lines.append("%s%s (%s)" % (number, story.title, story.url))
-        lines.append("%s%s | id=%s" % (" " * len(number), story.subtext, story.id))
-
-    return os.linesep.join(lines)
+        retval = None
+        while cmds:
+            # commands that only retrieve content are independent,
+            # so their retrieval can happen all at once; anything else
+            # (like cd or su) may change state and acts as a barrier
+            group = []
+            while cmds and self._prefetch_plan(cmds[0]) is not None:
+                group.append(cmds.pop(0))
+            if not group:
+                group.append(cmds.pop(0))
+            elif len(group) > 1:
+                self._prefetch(group)
+
+            try:
+                for c in group:
+                    retval = self.onecmd(c)
+            finally:
+                self._prefetched.clear()
+        return retval
+
+    def _prefetch_plan(self, line):
+        ''' Determines what content given command needs to retrieve.
+        Returns list of keys for the `_prefetched` dictionary,
+        or None if the command isn't one that just retrieves content.
+        '''
+        command, args, _ = self.parseline(line)
+        if command == 'refresh':
+            story = self._get_story(args) if args.strip() else None
+            return [('comments', story.id)] if story else []
+        if command != 'ls':
+            return None
 
+        try:
+            paths, filters, sort_field, _ = parse_query(args)
+        except ValueError:
+            return []
+        if filters or sort_field or len(paths) > 1:
+            dirs = [self._absolute_path(p).strip('/') for p in paths]
+            return [('stories', self.STORY_PAGES[d]) for d in dirs
+                    if d in self.STORY_PAGES and d not in self.story_dirs]
+
+        path = self._absolute_path(paths[0] if paths else '').strip('/')
+        if path in self.STORY_PAGES:
+            return [('stories', self.STORY_PAGES[path])]
+        if '/' in path:
+            story = self._get_story('/' + path)
+            return [('comments', story.id)] if story else []
+        return []
+
+    def _prefetch(self, lines):
+        ''' Retrieves content needed by given commands concurrently,
+        putting it in the `_prefetched` dictionary where the commands
+        will find it once they are executed.
+        Content that couldn't be retrieved is simply omitted, so that
+        the command itself retrieves it again (and reports any error).
+        '''
+        keys = set()
+        for line in lines:
+            keys.update(self._prefetch_plan(line))
+        if len(keys) < 2:
+            return
 
-def format_comments(comments, indent_width=4, recursive=True):
-    ''' Formats a list of Comment objects, producing text output. '''
-    if not comments:
-        return ""
+        def fetch(key):
+            kind, arg = key
+            try:
+                if kind == 'stories':
+                    result = list(self.hn_client.get_stories(arg))
+                else:
+                    result = self.hn_client.get_comments(arg)
+            except Exception:
+                return
+            self._prefetched[key] = result
 
-    console_width, _ = get_terminal_size()
-    def format_comment(comment):
-        ''' Helper function to format a single comment. '''
-        indent = " " * (indent_width * comment.level)
-        line_length = int(console_width * 0.95) - len(indent)
-        comment_lines = break_lines(comment.text, line_length)
-        indented_text = os.linesep.join(indent + line
-                                        for line in comment_lines)
+        threads = [threading.Thread(target=fetch, args=(key,))
+                   for key in keys]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-        return "%s%s (%s):\n%s\n" % (indent,
-            comment.author, comment.time, indented_text)
+    def emptyline(self):
+        pass # do nothing (and don't repeat last command)
 
-    lines = []
-    for i, comment in enumerate(comments):
-        lines.append(format_comment(comment))
-        if comment.replies:
-            lines.append(format_comments(comment.replies))
-            
-    return os.linesep.join(lines)
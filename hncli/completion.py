@@ -0,0 +1,175 @@
+'''
+Tab completion of "paths" within Hacker News shell.
+'''
+import threading
+from bisect import bisect_left, insort
+
+from .hn import Client
+
+
+class PrefixIndex(object):
+    ''' Sorted list of strings which answers prefix queries
+    using binary search.
+    '''
+    def __init__(self, items=()):
+        self._items = sorted(set(items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        idx = bisect_left(self._items, item)
+        if idx == len(self._items) or self._items[idx] != item:
+            self._items.insert(idx, item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def search(self, prefix, limit=None):
+        ''' Returns items starting with given prefix, in sorted order. '''
+        lo = bisect_left(self._items, prefix)
+        hi = lo
+        while hi < len(self._items) and self._items[hi].startswith(prefix):
+            hi += 1
+            if limit is not None and hi - lo >= limit:
+                break
+        return self._items[lo:hi]
+
+
+class TitleIndex(object):
+    ''' Index of story titles, for finding story IDs
+    by the (case-insensitive) beginning of their title.
+    '''
+    def __init__(self):
+        self._titles = []   # sorted list of (lowercase title, story_id)
+        self._ids = {}      # story_id -> lowercase title
+
+    def add(self, story_id, title):
+        title = title.lower()
+        old = self._ids.get(story_id)
+        if old == title:
+            return
+        if old is not None:
+            del self._titles[bisect_left(self._titles, (old, story_id))]
+        insort(self._titles, (title, story_id))
+        self._ids[story_id] = title
+
+    def search(self, prefix, limit=None):
+        ''' Returns IDs of stories whose title starts with given prefix. '''
+        prefix = prefix.lower()
+        res = []
+        idx = bisect_left(self._titles, (prefix,))
+        while idx < len(self._titles) and self._titles[idx][0].startswith(prefix):
+            res.append(self._titles[idx][1])
+            idx += 1
+            if limit is not None and len(res) >= limit:
+                break
+        return res
+
+
+class Completer(object):
+    ''' Completion engine for paths in HackerNews shell.
+    Keeps indexes of root directories, hexadecimal indexes of listed
+    stories and IDs/titles of all cached stories. Listings which
+    haven't been retrieved yet are fetched in the background;
+    they become available to subsequent completions.
+    '''
+    MAX_RESULTS = 100
+
+    def __init__(self, shell):
+        self.shell = shell
+        self.roots = PrefixIndex(shell.ROOT_DIRS + shell.ALL_STORIES_DIRS)
+        self.story_ids = PrefixIndex()
+        self.titles = TitleIndex()
+        self.dir_indexes = {}   # directory -> PrefixIndex of hex indexes
+
+        self._fetching = set()  # directories being fetched in background
+        self._fetched = {}      # directory -> list of stories fetched
+        self._lock = threading.Lock()
+
+    def add_stories(self, stories):
+        ''' Makes given stories known to the completer. '''
+        self.story_ids.update(str(story.id) for story in stories)
+        for story in stories:
+            self.titles.add(story.id, story.title)
+
+    def set_directory(self, directory, story_ids):
+        ''' Updates list of stories within given directory,
+        as they were numbered by last `ls` of it.
+        '''
+        width = len(hex(max(len(story_ids) - 1, 0))[2:])
+        self.dir_indexes[directory] = PrefixIndex(
+            hex(i)[2:].rjust(width, '0') for i in xrange(len(story_ids)))
+
+    def complete(self, arg, text):
+        ''' Returns completions for `text`, which is the part of
+        path argument `arg` that readline wants to be replaced.
+        '''
+        self._collect_fetched()
+
+        head, slash, tail = arg.rpartition('/')
+        directory = self.shell._absolute_path(head + slash or '.')
+        directory = directory.strip('/')
+        keep = text[:len(text) - len(tail)]     # part of text before tail
+
+        if not directory:
+            names = [name + '/' for name in self.roots.search(tail)]
+        elif '/' in directory:
+            names = []      # nothing below individual stories
+        elif directory in self.shell.ALL_STORIES_DIRS:
+            names = self.story_ids.search(tail, self.MAX_RESULTS)
+            if tail and not tail.isdigit():
+                names = [str(story_id) for story_id
+                         in self.titles.search(tail, self.MAX_RESULTS)]
+        elif directory in self.shell.STORY_PAGES:
+            index = self.dir_indexes.get(directory)
+            if index is None:
+                self._fetch_in_background(directory)
+                return []
+            names = index.search(tail)
+        else:
+            names = []
+
+        return [keep + name for name in names]
+
+    def _fetch_in_background(self, directory):
+        ''' Starts retrieving stories for given directory
+        in a separate thread.
+        The thread uses its own Client, which only shares the transport
+        with the shell's one, so that commands run in the meantime
+        (like `mirror`, which swaps the transport) don't affect it.
+        '''
+        with self._lock:
+            if directory in self._fetching:
+                return
+            self._fetching.add(directory)
+
+        client = Client(transport=self.shell.hn_client.transport)
+        page = self.shell.STORY_PAGES[directory]
+
+        def fetch():
+            try:
+                stories = list(client.get_stories(page))
+            except Exception:
+                stories = None
+            with self._lock:
+                self._fetching.discard(directory)
+                if stories is not None:
+                    self._fetched[directory] = stories
+
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+
+    def _collect_fetched(self):
+        ''' Hands stories fetched in the background over to the shell.
+        This is done from the shell's own thread, so that its caches
+        are never modified concurrently.
+        '''
+        with self._lock:
+            fetched, self._fetched = self._fetched, {}
+        for directory, stories in fetched.iteritems():
+            if directory not in self.shell.story_dirs:
+                self.shell._remember_stories(stories)
+                self.shell._set_story_dir(directory, stories)
@@ -2,6 +2,7 @@
 Interacting with Hacker News site.
 '''
 from re import compile as regex
+import time
 import requests
 from bs4 import BeautifulSoup
 
@@ -9,13 +10,41 @@ from .items import Story, Comment
 from .utils import cast
 
 
+class PageUnavailable(Exception):
+    ''' Raised when a Hacker News page couldn't be retrieved. '''
+    def __init__(self, url, status_code, reason=None):
+        Exception.__init__(self, url, status_code, reason)
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason or "HTTP error %s" % status_code
+
+    def __str__(self):
+        return "%s: %s" % (self.reason, self.url)
+
+
+class HttpTransport(object):
+    ''' Transport which performs actual HTTP requests,
+    using the python-requests library.
+    '''
+    def request(self, method, url, **kwargs):
+        ''' Performs HTTP request and returns the response object.
+        Responses returned by transports must provide the `text`,
+        `status_code`, `reason` and `cookies` attributes.
+        '''
+        func = getattr(requests, method)
+        return func(url, **kwargs)
+
+
 class Client(object):
     ''' A client for Hacker News website, accessing it via HTTP
     and parsing incoming HTML to extract useful information.
+    The way of accessing the site is determined by the transport,
+    which could be e.g. an offline archive (see the archive module).
     '''
     BASE_URL = "http://news.ycombinator.com"
 
-    def __init__(self):
+    def __init__(self, transport=None):
+        self.transport = transport or HttpTransport()
         self._reset_user_info()
 
     def _reset_user_info(self):
@@ -43,24 +72,32 @@ class Client(object):
         if not method in ['get', 'post']:
             return None
 
-        request_args = {'url': self._hn_url(page)}
+        request_args = {}
         if self.authenticated:
             request_args['cookies'] = {'user': self.auth_token}
         request_args.update(kwargs)
 
-        func = getattr(requests, method)
-        return func(**request_args)
+        return self.transport.request(method, self._hn_url(page),
+                                      **request_args)
 
-    def _fetch_page(self, page='/'):
+    def _fetch_page(self, page='/', with_time=False):
         ''' Retrieves given Hacker News page.
-        Returns the BeautifulSoup object with parsed HTML.
+        Returns the BeautifulSoup object with parsed HTML, or if
+        `with_time` is True, a tuple: (BeautifulSoup object, fetch time).
+        Fetch time is the current time, unless the transport tells
+        otherwise (e.g. for pages from an offline archive).
+        Raises PageUnavailable if the page couldn't be retrieved.
         '''
-        html = self._request('get', page).text
-        soup = BeautifulSoup(html)
+        resp = self._request('get', page)
+        if resp.status_code >= 400:
+            raise PageUnavailable(self._hn_url(page), resp.status_code,
+                                  resp.reason)
+        fetched_at = getattr(resp, 'fetched_at', None) or time.time()
+        soup = BeautifulSoup(resp.text)
 
         if self.authenticated:
             self._retrieve_user_info(soup)
-        return soup
+        return (soup, fetched_at) if with_time else soup
 
     def _fetch_item_page(self, item_id):
         ''' Retrieves page for given Hacker News item
@@ -123,7 +160,7 @@ class Client(object):
             return False
 
         data = {'fnid': fnid, 'u': user, 'p': password}
-        resp = requests.post(self._hn_url('y'), data=data)
+        resp = self.transport.request('post', self._hn_url('y'), data=data)
         token = resp.cookies.get('user')
         if not token:
             return False
@@ -140,9 +177,17 @@ class Client(object):
 
     def get_stories(self, page='/', count=None):
         ''' Retrieves stories from given Hacker News page.
-        Yields a sequence of Story objects. '''
-        if isinstance(page, basestring):
-            page = self._fetch_page(page)
+        Yields a sequence of Story objects.
+        If the page is fetched here (rather than passed as BeautifulSoup
+        object), its parse tree is destroyed as soon as all the stories
+        are extracted, before any of them is yielded.
+        Raises PageUnavailable if the page couldn't be retrieved.
+        '''
+        own_page = isinstance(page, basestring)
+        if own_page:
+            page, now = self._fetch_page(page, with_time=True)
+        else:
+            now = time.time()
 
         news_table = page.find('table').find_all('table')[1]
         news_trs = news_table.find_all('tr')[:-3]   # last 3 is garbage
@@ -151,8 +196,13 @@ class Client(object):
         if count is not None:
             items = items[:count]
 
-        for item in items:
-            story = Story.from_html(*item)
+        stories = [Story.from_html(*item, now=now) for item in items]
+        del news_table, news_trs, items
+        if own_page:
+            page.decompose()
+        del page
+
+        for story in stories:
             story.url = self._hn_url(story.url)
             yield story
 
@@ -160,19 +210,22 @@ class Client(object):
         ''' Retrieves comments from given page or item (story) of given ID.
         Returns list of top-level Comment objects,
         in the order they appear on page.
+        Parse tree of the page is destroyed once comments are extracted.
+        Raises PageUnavailable if the page couldn't be retrieved.
         '''
         if isinstance(item_or_url, (basestring, int, long)):
             item_id = cast(int, item_or_url)
             url = 'item?id=' + str(item_id) if item_id else item_or_url
-            page = self._fetch_page(url)
+            page, now = self._fetch_page(url, with_time=True)
 
         comments_table = page.find('table').find_all('table')[2]
         comment_spans = comments_table.find_all('span', {'class': 'comment'})
-        if not comment_spans:
-            return []
-
-        comments = [Comment.from_html(item_id, span)
+        comments = [Comment.from_html(item_id, span, now=now)
                     for span in comment_spans]
+        del comments_table, comment_spans
+        page.decompose()
+        if not comments:
+            return []
 
         # use order of comments and their levels
         # to reconstruct hierarchy of replies
@@ -183,7 +236,8 @@ class Client(object):
                 stack.append(last)
             else:   # reply to parent or top-level comment
                 level_diff = last.level - comment.level
-                stack = stack[:-level_diff]
+                if level_diff:
+                    stack = stack[:-level_diff]
                 if stack:
                     stack[-1].add_reply(comment)
             last = comment
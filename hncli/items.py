@@ -3,7 +3,7 @@ Objects representing Hacker News items: stories and comments.
 '''
 from re import compile as regex
 
-from .utils import cast
+from .utils import cast, parse_relative_time, format_relative_time
 
 
 class Story(object):
@@ -17,9 +17,11 @@ class Story(object):
             setattr(self, k, kw.get(k, ''))
 
     @staticmethod
-    def from_html(main_row, subtext_row):
+    def from_html(main_row, subtext_row, now=None):
         ''' Constructs Story from HN site markup elements.
         Arguments are <tr> elements obtained with BeautifulSoup.
+        Relative time of the story is resolved against `now`,
+        which should be the time when page was fetched.
         '''
         link = main_row.find_all('td')[2].a
         vote_td = main_row.find_all('td')[1]
@@ -27,23 +29,28 @@ class Story(object):
         comments_link = subtext.find('a', href=regex(r'item\?id\=.+'))
         not_job = bool(comments_link)
 
-        story = {'title': link.text, 'url': link['href']}
+        # only plain strings are kept, so that Story doesn't hold
+        # any references back into the parse tree
+        story = {'title': unicode(link.text), 'url': unicode(link['href'])}
         if not_job:
             points = cast(int, subtext.find('span', id=regex(r'score_\d+')
                                             ).text.split()[0], default=0)
             comments_count = cast(int, comments_link.text.split()[0],
                                   default=0)
             story.update({
-                'author': subtext.find('a', href=regex(r'user\?id\=.+')).text,
+                'author': unicode(
+                    subtext.find('a', href=regex(r'user\?id\=.+')).text),
                 'points': points,
-                'time': list(subtext.strings)[-2].replace('|', '').strip(),
+                'time': parse_relative_time(
+                    list(subtext.strings)[-2].replace('|', ''), now),
                 'comments_count': comments_count,
-                'comments_url': comments_link['href'],
-                'upvote_url': vote_td.find('a', id=regex(r'up_\d+'))['href'],
+                'comments_url': unicode(comments_link['href']),
+                'upvote_url': unicode(
+                    vote_td.find('a', id=regex(r'up_\d+'))['href']),
             })
             url = story['comments_url']
         else:
-            story['time'] = subtext.text
+            story['time'] = parse_relative_time(subtext.text, now)
             url = story['url']
 
         story['id'] = int(url[url.find('=')+1:])
@@ -56,10 +63,11 @@ class Story(object):
 
     @property
     def subtext(self):
+        time = format_relative_time(self.time)
         if self.job_post:
-            return self.time
+            return time
         return "%s points by %s %s | %s comments" % (
-            self.points, self.author, self.time, self.comments_count)
+            self.points, self.author, time, self.comments_count)
 
     def __str__(self):
         return "story:" + str(self.id)
@@ -80,10 +88,11 @@ class Comment(object):
         reply.parent = self
 
     @staticmethod
-    def from_html(story_id, tag):
+    def from_html(story_id, tag, now=None):
         ''' Constructs the Comment from HN site markup.
         'tag' argument is BeatifulSoup object for
         <span> tag with class=comment.
+        Relative time of the comment is resolved against `now`.
         '''
         if not (tag.name == 'span' and 'comment' in tag['class']):
             return
@@ -93,21 +102,113 @@ class Comment(object):
         indent_img = parent_tr.find('img', src=regex(r'.*/images/s\.gif'))
         reply_link = parent_tr.find('a', href=regex(r'reply\?.+'))
 
+        # as with Story, only plain strings are kept
         comment = {
             'story_id': story_id,
-            'url': head_span.find('a', href=regex(r'item\?id\=\d+'))['href'],
-            'author': head_span.find('a', href=regex(r'user\?id\=.+')).text,
-            'text': tag.text.strip(),
-            'time': list(head_span.strings)[-2].replace('|', '').strip(),
+            'url': unicode(
+                head_span.find('a', href=regex(r'item\?id\=\d+'))['href']),
+            'author': unicode(
+                head_span.find('a', href=regex(r'user\?id\=.+')).text),
+            'text': unicode(tag.text.strip()),
+            'time': parse_relative_time(
+                list(head_span.strings)[-2].replace('|', ''), now),
             'level': int(indent_img['width']) / 40, # magic number of pixels
             'parent': None,
             'replies': [],
-            'reply_url': reply_link['href'] if reply_link else None,
+            'reply_url': unicode(reply_link['href']) if reply_link else None,
         }
 
         url = comment['url']
-        comment['id'] = int(url[url.find('=')+1:]),
+        comment['id'] = int(url[url.find('=')+1:])
         return Comment(**comment)
 
+    def walk(self):
+        ''' Yields this comment and all its replies, recursively. '''
+        yield self
+        for reply in self.replies:
+            for comment in reply.walk():
+                yield comment
+
+    def __str__(self):
+        return "comment:" + str(self.id)
+
+
+class CommentsDiff(object):
+    ''' Changes found in a comment thread when refreshing it. '''
+    __slots__ = ['new', 'edited', 'moved', 'removed']
+
+    def __init__(self):
+        self.new = []
+        self.edited = []
+        self.moved = []
+        self.removed = []
+
+    def __nonzero__(self):
+        return bool(self.new or self.edited or self.moved or self.removed)
+
     def __str__(self):
-        return "comment:" + str(self.id)
\ No newline at end of file
+        return "+%s ~%s >%s -%s" % (len(self.new), len(self.edited),
+                                     len(self.moved), len(self.removed))
+
+
+def merge_comments(comments, fresh):
+    ''' Merges freshly retrieved comment thread into existing one,
+    matching comments by their IDs. `comments` is the list of top-level
+    Comment objects that is updated in place to match the fresh thread,
+    including the order of replies. Only new, edited, moved (i.e. now
+    replying to a different comment), re-ranked and removed comments
+    are touched.
+    Returns CommentsDiff describing the changes.
+    '''
+    known = dict((c.id, c) for top_level in comments for c in top_level.walk())
+    seen = set()
+    diff = CommentsDiff()
+
+    def merge(fresh_replies, parent, replies):
+        # replies[:pos] are always the fresh replies merged so far, in their
+        # fresh order; stale ones end up after them and get removed below
+        for pos, reply in enumerate(fresh_replies):
+            comment = known.get(reply.id)
+            if comment is None:
+                # insert new comment without its replies, which are merged
+                # below, as some of them may be known already
+                comment, children = reply, reply.replies
+                comment.replies = []
+                replies.insert(pos, comment)
+                comment.parent = parent
+                diff.new.append(comment)
+            else:
+                children = reply.replies
+                if comment.parent is not parent:
+                    old_replies = (comments if comment.parent is None
+                                   else comment.parent.replies)
+                    old_replies.remove(comment)
+                    replies.insert(pos, comment)
+                    comment.parent = parent
+                    diff.moved.append(comment)
+                elif replies[pos] is not comment:
+                    # re-ranked among its siblings
+                    replies.remove(comment)
+                    replies.insert(pos, comment)
+                if comment.text != reply.text:
+                    comment.text = reply.text
+                    diff.edited.append(comment)
+                comment.level = reply.level
+
+            seen.add(comment.id)
+            merge(children, comment, comment.replies)
+
+    merge(fresh, None, comments)
+
+    # replies that survived have been moved away by now,
+    # so removed comments can be detached along with their subtrees
+    removed = set(known) - seen
+    for comment_id in removed:
+        comment = known[comment_id]
+        diff.removed.append(comment)
+        if comment.parent is None:
+            comments.remove(comment)
+        elif comment.parent.id not in removed:
+            comment.parent.replies.remove(comment)
+
+    return diff
@@ -4,13 +4,29 @@ hncli -- Main entry point
 '''
 import sys
 import getpass
+import argparse
 import webbrowser
 
+from . import hn, archive, render
 from .cli import HackerNews
 
 
 def main():
-    hncli = HackerNews()
+    parser = argparse.ArgumentParser(prog='hncli')
+    parser.add_argument('--offline', metavar='ARCHIVE', nargs='?',
+                        const=archive.DEFAULT_PATH,
+                        help="browse pages from local archive created "
+                             "with `mirror` command, without network access")
+    parser.add_argument('--output', choices=sorted(render.RENDERERS),
+                        default='plain', help="how to display content")
+    args = parser.parse_args()
+
+    client = None
+    if args.offline:
+        transport = archive.ArchiveTransport(archive.Archive(args.offline))
+        client = hn.Client(transport=transport)
+
+    hncli = HackerNews(client=client, renderer=render.RENDERERS[args.output])
     hncli.intro = "\n".join([
         "hncli :: command-line interface for Hacker News",
         "[running Python %s on %s]" % (
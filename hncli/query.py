@@ -0,0 +1,178 @@
+'''
+Filtering and sorting of cached stories.
+'''
+import re
+from bisect import bisect_left, bisect_right, insort
+
+from .utils import cast
+
+
+NUMERIC_FIELDS = ['id', 'points', 'comments_count', 'time']
+TEXT_FIELDS = ['author', 'title', 'url']
+FIELDS = NUMERIC_FIELDS + TEXT_FIELDS
+
+OPERATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '~': lambda a, b: b.lower() in a.lower(),
+}
+_filter_re = re.compile(r'^(%s)(!=|>=|<=|=|>|<|~)(.+)$' % '|'.join(FIELDS))
+_sort_re = re.compile(r'^sort:(-?)(%s)$' % '|'.join(FIELDS))
+
+
+class Filter(object):
+    ''' Single condition imposed on a story field, e.g. points>100. '''
+    __slots__ = ['field', 'op', 'value']
+
+    def __init__(self, field, op, value):
+        if field in NUMERIC_FIELDS and op != '~':
+            number = cast(int, value, default=None)
+            if number is None:
+                raise ValueError("invalid number in expression: %s%s%s"
+                                 % (field, op, value))
+            value = number
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def matches(self, story):
+        value = getattr(story, self.field)
+        if self.field in NUMERIC_FIELDS and not isinstance(value, (int, long)):
+            return False    # e.g. job posts, which have no points
+        if self.op == '~':
+            value = unicode(value)
+        return OPERATORS[self.op](value, self.value)
+
+    def __str__(self):
+        return "%s%s%s" % (self.field, self.op, self.value)
+
+
+def parse_query(args):
+    ''' Parses arguments of `ls` command that may contain filter
+    expressions (e.g. points>100 or author=pg) and sort order
+    (e.g. sort:comments_count, or sort:-points for descending).
+    Returns a tuple: (paths, filters, sort_field, descending).
+    Raises ValueError if an expression is malformed.
+    '''
+    paths, filters = [], []
+    sort_field, descending = None, False
+    for arg in args.split():
+        sort_match = _sort_re.match(arg)
+        if sort_match:
+            descending = bool(sort_match.group(1))
+            sort_field = sort_match.group(2)
+            continue
+        filter_match = _filter_re.match(arg)
+        if filter_match:
+            filters.append(Filter(*filter_match.groups()))
+            continue
+        if arg.startswith('sort:') or any(op in arg for op in OPERATORS):
+            raise ValueError("invalid expression: " + arg)
+        paths.append(arg)
+
+    return paths, filters, sort_field, descending
+
+
+def sort_stories(stories, field, descending=False):
+    ''' Sorts stories by given field. Stories which lack the field's value
+    (like points of job posts) always end up at the end.
+    '''
+    present = [s for s in stories if getattr(s, field) not in ('', None)]
+    missing = [s for s in stories if getattr(s, field) in ('', None)]
+    present.sort(key=lambda s: getattr(s, field), reverse=descending)
+    return present + missing
+
+
+class StoryIndex(object):
+    ''' Secondary indexes over cached stories, used to quickly narrow
+    down the set of stories that may match given filters.
+    '''
+    POINTS_BUCKET = 50
+
+    def __init__(self):
+        self.by_author = {}         # author -> set of story IDs
+        self.by_points = {}         # points bucket -> set of story IDs
+        self.by_comments = []       # sorted list of (comments_count, ID)
+        self._entries = {}          # story ID -> (author, bucket, count)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, story):
+        ''' Adds story to the indexes, or updates its entries
+        if it has been indexed before.
+        '''
+        if story.id in self._entries:
+            self.remove(story.id)
+
+        author = story.author or None
+        bucket = (story.points // self.POINTS_BUCKET
+                  if isinstance(story.points, (int, long)) else None)
+        count = (story.comments_count
+                 if isinstance(story.comments_count, (int, long)) else None)
+
+        if author is not None:
+            self.by_author.setdefault(author, set()).add(story.id)
+        if bucket is not None:
+            self.by_points.setdefault(bucket, set()).add(story.id)
+        if count is not None:
+            insort(self.by_comments, (count, story.id))
+        self._entries[story.id] = (author, bucket, count)
+
+    def remove(self, story_id):
+        ''' Removes story of given ID from the indexes. '''
+        entry = self._entries.pop(story_id, None)
+        if entry is None:
+            return
+        author, bucket, count = entry
+
+        if author is not None:
+            self.by_author[author].discard(story_id)
+        if bucket is not None:
+            self.by_points[bucket].discard(story_id)
+        if count is not None:
+            idx = bisect_left(self.by_comments, (count, story_id))
+            del self.by_comments[idx]
+
+    def candidates(self, filters):
+        ''' Returns set of IDs of stories that may match given filters,
+        or None if none of the filters can be answered from indexes.
+        The result is a superset of actual matches, so filters
+        still need to be applied to the stories themselves.
+        '''
+        result = None
+        for f in filters:
+            ids = self._lookup(f)
+            if ids is not None:
+                result = ids if result is None else result & ids
+        return result
+
+    def _lookup(self, f):
+        if f.field == 'author' and f.op == '=':
+            return set(self.by_author.get(f.value, ()))
+        if f.field == 'points' and f.op in ('=', '>', '>=', '<', '<='):
+            bucket = f.value // self.POINTS_BUCKET
+            if f.op == '=':
+                return set(self.by_points.get(bucket, ()))
+            if f.op in ('>', '>='):
+                buckets = [b for b in self.by_points if b >= bucket]
+            else:
+                buckets = [b for b in self.by_points if b <= bucket]
+            return set().union(*[self.by_points[b] for b in buckets])
+        if f.field == 'comments_count' and f.op in ('=', '>', '>=',
+                                                    '<', '<='):
+            lo, hi = 0, len(self.by_comments)
+            if f.op in ('=', '>='):
+                lo = bisect_left(self.by_comments, (f.value,))
+            elif f.op == '>':
+                lo = bisect_right(self.by_comments, (f.value, float('inf')))
+            if f.op in ('=', '<='):
+                hi = bisect_right(self.by_comments, (f.value, float('inf')))
+            elif f.op == '<':
+                hi = bisect_left(self.by_comments, (f.value,))
+            return set(story_id for _, story_id in self.by_comments[lo:hi])
+        return None
@@ -0,0 +1,254 @@
+'''
+Rendering of Hacker News content for output in terminal.
+
+Renderers don't write anything immediately: output is accumulated
+in a buffer and written to the stream all at once with flush().
+'''
+import os
+import sys
+import json
+
+from .utils import get_terminal_size, break_lines, format_relative_time
+
+
+class Renderer(object):
+    ''' Base class for renderers. Subclasses define how stories
+    and comments are presented.
+    '''
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.width = None
+        self._buffer = []
+
+    def begin(self):
+        ''' Prepares renderer for output of a single command.
+        Terminal size is measured here, so it's only done once
+        regardless of how much is rendered.
+        '''
+        self.width, _ = get_terminal_size()
+
+    def write(self, text):
+        self._buffer.append(text)
+
+    def line(self, text=""):
+        self._buffer.append(text)
+        self._buffer.append(os.linesep)
+
+    def flush(self):
+        ''' Writes all the buffered output to the stream. '''
+        if not self._buffer:
+            return
+        output, self._buffer = u"".join(self._buffer), []
+        self.stream.write(output)
+        self.stream.flush()
+
+    def message(self, text):
+        ''' Outputs informational or error message. '''
+        self.line(text)
+
+    def directories(self, names):
+        raise NotImplementedError()
+
+    def stories(self, stories):
+        raise NotImplementedError()
+
+    def story_results(self, results):
+        ''' Outputs stories found by a query, given as list of
+        (path, story) pairs, where path is where the story can be found.
+        '''
+        raise NotImplementedError()
+
+    def comments(self, comments, recursive=True):
+        raise NotImplementedError()
+
+    def comments_diff(self, diff):
+        ''' Outputs changes in comment thread described by CommentsDiff. '''
+        if diff.new:
+            self.message("New comments:")
+            self.comments(diff.new, recursive=False)
+        if diff.edited:
+            self.message("Edited comments:")
+            self.comments(diff.edited, recursive=False)
+        if diff.moved:
+            self.message("Moved comments:")
+            self.comments(diff.moved, recursive=False)
+        if diff.removed:
+            self.message("%s comment(s) removed" % len(diff.removed))
+
+    def _walk(self, comments, recursive):
+        ''' Yields comments in display order, without recursive calls. '''
+        stack = list(reversed(comments))
+        while stack:
+            comment = stack.pop()
+            yield comment
+            if recursive and comment.replies:
+                stack.extend(reversed(comment.replies))
+
+    def _level(self, comment, recursive):
+        ''' Returns indentation level of comment in the output.
+        Comments listed without their replies are shown as a flat list,
+        as their thread levels would only suggest replies that aren't there.
+        '''
+        return comment.level if recursive else 0
+
+    @property
+    def _console_width(self):
+        if self.width is None:
+            self.begin()
+        return self.width
+
+
+class PlainRenderer(Renderer):
+    ''' Renders content as plain text. '''
+    INDENT_WIDTH = 4
+
+    def directories(self, names):
+        self.line('\t'.join(names))
+
+    def stories(self, stories):
+        number_width = len(hex(max(len(stories) - 1, 0))[2:])
+        for i, story in enumerate(stories):
+            number = hex(i)[2:].rjust(number_width, '0') + ": "
+            self.line("%s%s (%s)" % (self._number(number),
+                                     self._title(story.title), story.url))
+            self.line("%s%s | id=%s" % (" " * len(number),
+                                        story.subtext, story.id))
+
+    def story_results(self, results):
+        path_width = max([len(path) for path, _ in results] or [0])
+        for path, story in results:
+            self.line("%s  %s (%s)" % (self._number(path.ljust(path_width)),
+                                       self._title(story.title), story.url))
+            self.line("%s  %s" % (" " * path_width, story.subtext))
+
+    def comments(self, comments, recursive=True):
+        line_length = int(self._console_width * 0.95)
+        for comment in self._walk(comments, recursive):
+            level = self._level(comment, recursive)
+            indent = " " * (self.INDENT_WIDTH * level)
+            self.line("%s%s (%s):" % (indent, self._author(comment.author),
+                                      format_relative_time(comment.time)))
+            for text_line in break_lines(comment.text,
+                                         line_length - len(indent)):
+                self.line(indent + text_line)
+            self.line()
+
+    # hooks for decorating parts of output
+    _number = _title = _author = staticmethod(lambda text: text)
+
+
+class ColorRenderer(PlainRenderer):
+    ''' Renders content as text highlighted with ANSI color codes. '''
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+    YELLOW = '\033[33m'
+    CYAN = '\033[36m'
+
+    def _number(self, text):
+        return self.YELLOW + text + self.RESET
+
+    def _title(self, text):
+        return self.BOLD + text + self.RESET
+
+    def _author(self, text):
+        return self.CYAN + text + self.RESET
+
+
+class CompactRenderer(Renderer):
+    ''' Renders content as text, using single line per item. '''
+    def directories(self, names):
+        self.line(' '.join(names))
+
+    def stories(self, stories):
+        number_width = len(hex(max(len(stories) - 1, 0))[2:])
+        for i, story in enumerate(stories):
+            number = hex(i)[2:].rjust(number_width, '0')
+            self._story_line(number, story)
+
+    def story_results(self, results):
+        for path, story in results:
+            self._story_line(path, story)
+
+    def _story_line(self, prefix, story):
+        if story.job_post:
+            self.line("%s %s" % (prefix, story.title))
+        else:
+            self.line("%s %s [%s/%s]" % (prefix, story.title,
+                                         story.points, story.comments_count))
+
+    def comments(self, comments, recursive=True):
+        width = self._console_width - 1
+        for comment in self._walk(comments, recursive):
+            level = self._level(comment, recursive)
+            text = "%s%s: %s" % (" " * (2 * level), comment.author,
+                                 " ".join(comment.text.split()))
+            if len(text) > width:
+                text = text[:width - 3] + "..."
+            self.line(text)
+
+
+class JsonRenderer(Renderer):
+    ''' Renders content as JSON, one document per output.
+    Messages go to stderr, so that output remains valid JSON.
+    '''
+    STORY_FIELDS = ['id', 'title', 'url', 'author', 'points', 'time',
+                    'comments_count', 'comments_url']
+    COMMENT_FIELDS = ['id', 'story_id', 'author', 'text', 'time', 'level']
+
+    def message(self, text):
+        print >>sys.stderr, text
+
+    def directories(self, names):
+        self._json(names)
+
+    def stories(self, stories):
+        self._json([self._story(s) for s in stories])
+
+    def story_results(self, results):
+        res = []
+        for path, story in results:
+            res.append(self._story(story))
+            res[-1]['path'] = path
+        self._json(res)
+
+    def comments(self, comments, recursive=True):
+        self._json(self._comments(comments, recursive))
+
+    def comments_diff(self, diff):
+        self._json({
+            'new': self._comments(diff.new, False),
+            'edited': self._comments(diff.edited, False),
+            'moved': self._comments(diff.moved, False),
+            'removed': [c.id for c in diff.removed],
+        })
+
+    def _story(self, story):
+        return dict((f, getattr(story, f)) for f in self.STORY_FIELDS)
+
+    def _comments(self, comments, recursive):
+        ''' Converts comments into list of dicts, with their replies
+        nested if `recursive` is True. Like _walk(), it uses explicit
+        stack rather than recursive calls.
+        '''
+        res = []
+        stack = [(c, res) for c in reversed(comments)]
+        while stack:
+            comment, siblings = stack.pop()
+            obj = dict((f, getattr(comment, f)) for f in self.COMMENT_FIELDS)
+            siblings.append(obj)
+            if recursive:
+                obj['replies'] = []
+                stack.extend((c, obj['replies'])
+                             for c in reversed(comment.replies))
+        return res
+
+    def _json(self, obj):
+        self.line(json.dumps(obj))
+
+
+RENDERERS = {
+    'plain': PlainRenderer,
+    'color': ColorRenderer,
+    'compact': CompactRenderer,
+    'json': JsonRenderer,
+}
@@ -5,6 +5,8 @@ import re
 import tempfile
 import os
 import subprocess
+import time
+from bisect import bisect_left, bisect_right, insort
 
 
 _none = object()
@@ -45,6 +47,110 @@ def break_lines(text, max_length):
     return res
 
 
+## Relative time phrases
+
+TIME_UNITS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+    'week': 7 * 24 * 60 * 60,
+    'month': 30 * 24 * 60 * 60,
+    'year': 365 * 24 * 60 * 60,
+}
+_TIME_UNITS_ORDER = sorted(TIME_UNITS.items(), key=lambda item: -item[1])
+_relative_time_re = re.compile(
+    r'(\d+|an?)\s+(%s)s?\s+ago' % '|'.join(TIME_UNITS), re.IGNORECASE)
+
+def parse_relative_time(text, now=None):
+    ''' Converts relative time phrase, such as "3 hours ago",
+    into absolute timestamp (seconds since epoch), counting back
+    from `now` (current time by default).
+    Returns None if the phrase is not understood.
+    '''
+    if now is None:
+        now = time.time()
+    text = text.strip()
+
+    # fast path for HN's own "<N> <unit>[s] ago" phrasing
+    parts = text.split()
+    if len(parts) == 3 and parts[2] == 'ago':
+        seconds = TIME_UNITS.get(parts[1].rstrip('s'))
+        if seconds and parts[0].isdigit():
+            return int(now) - int(parts[0]) * seconds
+
+    match = _relative_time_re.search(text)
+    if not match:
+        return None
+    count, unit = match.groups()
+    count = 1 if count.lower() in ('a', 'an') else int(count)
+    return int(now) - count * TIME_UNITS[unit.lower()]
+
+def format_relative_time(timestamp, now=None):
+    ''' Formats given timestamp as relative time phrase,
+    in the same form that Hacker News uses (e.g. "3 hours ago").
+    '''
+    if timestamp is None:
+        return ""
+    if now is None:
+        now = time.time()
+
+    delta = max(int(now - timestamp), 0)
+    for unit, seconds in _TIME_UNITS_ORDER:
+        if delta >= seconds:
+            count = delta // seconds
+            return "%d %s%s ago" % (count, unit, "s" if count != 1 else "")
+    return "0 seconds ago"
+
+
+class TimeIndex(object):
+    ''' Index of items ordered by their timestamps,
+    allowing to quickly find those from given time range.
+    '''
+    def __init__(self):
+        self._keys = []     # sorted list of (timestamp, item_id)
+        self._items = {}    # item_id -> (timestamp, item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, timestamp, item_id, item=None):
+        ''' Adds item to the index, replacing previous entry
+        for the same item ID (if any).
+        '''
+        if timestamp is None:
+            return
+        if item_id in self._items:
+            self.remove(item_id)
+        insort(self._keys, (timestamp, item_id))
+        self._items[item_id] = (timestamp, item)
+
+    def remove(self, item_id):
+        ''' Removes item of given ID from the index. '''
+        entry = self._items.pop(item_id, None)
+        if entry is None:
+            return
+        key = (entry[0], item_id)
+        idx = bisect_left(self._keys, key)
+        if idx < len(self._keys) and self._keys[idx] == key:
+            del self._keys[idx]
+
+    def between(self, start=None, end=None):
+        ''' Returns items whose timestamps fall within [start, end] range,
+        ordered from the oldest one. Either bound can be omitted.
+        '''
+        lo = 0 if start is None else bisect_left(self._keys, (start,))
+        hi = (len(self._keys) if end is None
+              else bisect_right(self._keys, (end, float('inf'))))
+        return [self._items[item_id][1] for _, item_id in self._keys[lo:hi]]
+
+    def since(self, seconds, now=None):
+        ''' Returns items from last given number of seconds. '''
+        if now is None:
+            now = time.time()
+        return self.between(start=now - seconds)
+
+
 ## Obtaining long input using a console editor
 
 def long_input(prompt):
@@ -0,0 +1,216 @@
+'''
+Simulated Hacker News server, serving generated pages
+with the same markup structure as the real site.
+'''
+import re
+import time
+import random
+import threading
+from cgi import escape
+from urlparse import urlsplit, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+LISTING_PAGES = ['/news', '/newest', '/ask', '/jobs']
+
+_PAGE = ('<html><head><title>Hacker News</title></head><body>'
+         '<center><table border="0" cellpadding="0" cellspacing="0">'
+         '<tr><td><table border="0" cellpadding="0" cellspacing="0">'
+         '<tr><td><span class="pagetop"><b>Hacker News</b></span></td>'
+         '<td><span class="pagetop"><a href="newslogin">login</a></span>'
+         '</td></tr></table></td></tr>%s</table></center></body></html>')
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+          "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+def listing_html(stories):
+    ''' Generates HTML of a listing page. `stories` is a list
+    of (id, title, author, points, comments_count, hours_ago) tuples.
+    '''
+    rows = []
+    for rank, (id_, title, author, points, comments, hours) in \
+            enumerate(stories, 1):
+        rows.append(
+            '<tr><td align="right" class="title">%d.</td>'
+            '<td><center><a id="up_%d" href="vote?for=%d&amp;dir=up">'
+            '<img src="grayarrow.gif"></a></center></td>'
+            '<td class="title"><a href="http://example.com/%d">%s</a></td>'
+            '</tr>' % (rank, id_, id_, id_, escape(title)))
+        rows.append(
+            '<tr><td colspan="2"></td><td class="subtext">'
+            '<span id="score_%d">%d points</span> by '
+            '<a href="user?id=%s">%s</a> %d hours ago  | '
+            '<a href="item?id=%d">%d comments</a></td></tr>'
+            % (id_, points, author, author, hours, id_, comments))
+        rows.append('<tr style="height:5px"></tr>')
+    rows.append('<tr style="height:10px"></tr>')
+    rows.append('<tr><td colspan="2"></td>'
+                '<td class="title"><a href="news2">More</a></td></tr>')
+    rows.append('<tr><td></td></tr>')
+    return _PAGE % ('<tr><td><table border="0" cellpadding="0" '
+                    'cellspacing="0">%s</table></td></tr>' % ''.join(rows))
+
+
+def thread_html(story_id, comments):
+    ''' Generates HTML of an item page with comments. `comments` is
+    a list of (id, level, author, text, minutes_ago) tuples,
+    in the order they appear on the page.
+    '''
+    rows = []
+    for id_, level, author, text, minutes in comments:
+        rows.append(
+            '<tr><td><table border="0"><tr>'
+            '<td><img src="http://ycombinator.com/images/s.gif" '
+            'height="1" width="%d"></td>'
+            '<td class="default"><div><span class="comhead">'
+            '<a href="user?id=%s">%s</a> %d minutes ago  | '
+            '<a href="item?id=%d">link</a></span></div><br>'
+            '<span class="comment"><font color="#000000">%s</font></span>'
+            '<p><font size="1"><u><a href="reply?id=%d&amp;whence=item">'
+            'reply</a></u></font></p></td></tr></table></td></tr>'
+            % (level * 40, author, author, minutes, id_, escape(text), id_))
+    story = ('<tr><td><table border="0"><tr><td class="title">'
+             '<a href="http://example.com/%d">Story %d</a></td></tr>'
+             '</table></td></tr>' % (story_id, story_id))
+    comments = ('<tr><td><table border="0">%s</table></td></tr>'
+                % ''.join(rows))
+    return _PAGE % (story + comments)
+
+
+class SimulatedSite(object):
+    ''' Generator of Hacker News pages. Every listing has `page_size`
+    stories and every story has `comments` comments. Pages are
+    deterministic for given `seed`, except for /newest which gains
+    a new story with each request, so that the set of known stories
+    keeps growing.
+    '''
+    def __init__(self, page_size=30, comments=50, seed=0):
+        self.page_size = page_size
+        self.comments = comments
+        self._seed = seed
+        self._lock = threading.Lock()
+        self._newest = 1000000
+
+    def page(self, path, query):
+        ''' Returns HTML of given page, or None if there is no such page. '''
+        if path in ('/', '/news'):
+            first = 1
+        elif path == '/newest':
+            with self._lock:
+                self._newest += 1
+                first = self._newest
+        elif path in LISTING_PAGES:
+            first = 1 + 1000 * LISTING_PAGES.index(path)
+        elif path == '/item' and re.match(r'^\d+$', query.get('id', '')):
+            return self._thread(int(query['id']))
+        else:
+            return None
+        return listing_html([self._story(id_) for id_
+                             in xrange(first, first + self.page_size)])
+
+    def page_for_url(self, url):
+        ''' Returns HTML of page with given URL, or None. '''
+        url = urlsplit(url)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).iteritems())
+        return self.page(url.path, query)
+
+    def _story(self, id_):
+        rnd = random.Random(self._seed + id_)
+        title = ' '.join(rnd.choice(_WORDS) for _ in xrange(6)).capitalize()
+        return (id_, title, 'user%d' % rnd.randint(1, 500),
+                rnd.randint(1, 900), self.comments, rnd.randint(1, 23))
+
+    def _thread(self, story_id):
+        rnd = random.Random(self._seed + story_id)
+        comments, level = [], 0
+        for i in xrange(self.comments):
+            level = rnd.randint(0, level + 1) if i else 0
+            text = ' '.join(rnd.choice(_WORDS)
+                            for _ in xrange(rnd.randint(5, 80)))
+            comments.append((story_id * 1000 + i, level,
+                             'user%d' % rnd.randint(1, 500), text,
+                             rnd.randint(1, 600)))
+        return thread_html(story_id, comments)
+
+
+class SiteResponse(object):
+    ''' Response returned by SiteTransport, with the attributes
+    hncli Client expects of its transports' responses.
+    '''
+    def __init__(self, text=u'', status_code=200, reason="OK"):
+        self.text = text
+        self.status_code = status_code
+        self.reason = reason
+        self.cookies = {}
+
+
+class SiteTransport(object):
+    ''' Transport for hncli Client serving pages of SimulatedSite
+    directly, without any HTTP traffic.
+    '''
+    def __init__(self, site):
+        self.site = site
+
+    def request(self, method, url, **kwargs):
+        html = self.site.page_for_url(url) if method == 'get' else None
+        if html is None:
+            return SiteResponse(status_code=404, reason="Not Found")
+        return SiteResponse(html)
+
+
+class SimulatedHN(ThreadingMixIn, HTTPServer):
+    ''' HTTP server imitating Hacker News, running in background thread
+    and serving pages of SimulatedSite. Each response is delayed
+    by `latency` seconds (with `jitter` fraction of random variation).
+    '''
+    daemon_threads = True
+
+    def __init__(self, page_size=30, comments=50, latency=0.0, jitter=0.0,
+                 port=0, seed=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.site = SimulatedSite(page_size, comments, seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def delay(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            jitter = self.latency * self.jitter
+            time.sleep(max(0, self.latency + random.uniform(-jitter, jitter)))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.delay()
+        html = self.server.site.page_for_url(self.path)
+        if html is None:
+            self.send_error(404)
+            return
+
+        body = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # keep the output of tools clean
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+'''
+Memory benchmark of listing stories and comments with hncli Client.
+
+Pages are generated by simulated site and parsed in-process. Every
+scenario runs in a separate subprocess and reports, per listed item:
+
+* peak: growth of peak RSS of the process while listing,
+* retained: size of everything reachable from the kept Story/Comment
+  objects (which includes any parse tree they still refer to).
+
+The "tree" scenarios keep the BeautifulSoup objects alive next to the
+extracted items, which shows the cost of retaining parse trees, e.g.:
+
+    python tools/membench.py --pages 50
+'''
+import os
+import gc
+import sys
+import json
+import types
+import argparse
+import resource
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from hncli import hn
+from hnsim import SimulatedSite, SiteTransport, LISTING_PAGES
+
+
+SCENARIOS = ['stories', 'stories-tree', 'comments', 'comments-tree']
+
+
+def rss_bytes():
+    ''' Returns current resident set size of this process. '''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def peak_rss_bytes():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def deep_size(roots):
+    ''' Computes total size of objects reachable from given ones.
+    Types, modules, functions and other shared objects are not counted.
+    '''
+    skip = (type, types.ModuleType, types.FunctionType,
+            types.BuiltinFunctionType, types.ClassType)
+    seen = set()
+    stack = list(roots)
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, skip) or obj is None:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def run_scenario(scenario, pages, page_size, comments):
+    ''' Lists items according to scenario, returning the measurements. '''
+    site = SimulatedSite(page_size=page_size, comments=comments)
+    client = hn.Client(transport=SiteTransport(site))
+    keep_tree = scenario.endswith('-tree')
+    items, trees = [], []
+
+    gc.collect()
+    rss_before = rss_bytes()
+    for i in xrange(pages):
+        if scenario.startswith('stories'):
+            page = LISTING_PAGES[1]     # /newest, with new stories each time
+            if keep_tree:
+                page = client._fetch_page(page)
+                trees.append(page)
+            items.extend(client.get_stories(page))
+        else:
+            if keep_tree:
+                # what get_comments() would retain without freeing the tree
+                trees.append(client._fetch_item_page(i + 1))
+            for top_level in client.get_comments(i + 1):
+                items.extend(top_level.walk())
+
+    gc.collect()
+    return {
+        'scenario': scenario,
+        'items': len(items),
+        'peak': peak_rss_bytes() - rss_before,
+        'retained': deep_size([items] + trees),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', type=int, default=20,
+                        help="number of pages to list in every scenario")
+    parser.add_argument('--page-size', type=int, default=30,
+                        help="number of stories on every listing")
+    parser.add_argument('--comments', type=int, default=100,
+                        help="number of comments on every story")
+    parser.add_argument('--scenario', choices=SCENARIOS,
+                        help="run only given scenario in this process, "
+                             "printing results as JSON")
+    args = parser.parse_args()
+
+    if args.scenario:
+        res = run_scenario(args.scenario, args.pages, args.page_size,
+                           args.comments)
+        print json.dumps(res)
+        return
+
+    print "%-15s %8s %14s %14s" % ("scenario", "items",
+                                   "peak B/item", "retained B/item")
+    for scenario in SCENARIOS:
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__),
+            '--scenario', scenario, '--pages', str(args.pages),
+            '--page-size', str(args.page_size),
+            '--comments', str(args.comments)])
+        res = json.loads(output.splitlines()[-1])
+        count = max(res['items'], 1)
+        print "%-15s %8d %14d %14d" % (scenario, res['items'],
+                                       res['peak'] / count,
+                                       res['retained'] / count)
+
+
+if __name__ == '__main__':
+    main()
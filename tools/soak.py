@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+'''
+Soak/load test of hncli against simulated Hacker News server.
+
+Runs scripted shell sessions in a loop for given duration, then reports
+throughput, latency percentiles of every command and memory usage
+over time. Exits with non-zero status if any of the given thresholds
+has been exceeded, e.g.:
+
+    python tools/soak.py --duration 3600 --latency 0.05 \\
+        --max-p99 500 --max-rss-growth 50
+'''
+import os
+import gc
+import sys
+import time
+import argparse
+import resource
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from hncli import hn
+from hncli.cli import HackerNews
+from hnsim import SimulatedHN
+
+
+DEFAULT_SCRIPT = [
+    "ls top",
+    "ls top/00",
+    "ls new && ls ask && ls jobs",
+    "refresh top/00",
+    "cd /top && ls 01 && cd /",
+    "ls all points>100 sort:-comments_count",
+]
+
+
+def rss_bytes():
+    ''' Returns current resident set size of this process. '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # fallback: peak rather than current RSS (in KB on Linux, B on Mac)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def live_tags():
+    ''' Returns number of BeautifulSoup tags that are still alive. '''
+    from bs4.element import Tag
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, Tag))
+
+
+def percentile(values, p):
+    ''' Returns p-th percentile of values, using nearest-rank method. '''
+    values = sorted(values)
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Soak(object):
+    ''' Runs the shell commands repeatedly, collecting measurements. '''
+
+    def __init__(self, server, script, sample_interval=5.0,
+                 track_tags=False):
+        self.server = server
+        self.script = script
+        self.sample_interval = sample_interval
+        self.track_tags = track_tags
+
+        self.latencies = {}     # command line -> list of seconds
+        self.samples = []       # list of (elapsed, rss, stories, tags)
+        self.commands = 0
+        self.elapsed = 0.0
+        self.warmup_sample = 0  # index of first sample after warm-up
+
+    def _shell(self):
+        client = hn.Client()
+        client.BASE_URL = self.server.url
+        return HackerNews(client=client, stdout=open(os.devnull, 'w'))
+
+    def _sample(self, shell, elapsed):
+        gc.collect()
+        tags = live_tags() if self.track_tags else None
+        self.samples.append((elapsed, rss_bytes(), len(shell.stories), tags))
+
+    def run(self, duration):
+        shell = self._shell()
+        start = time.time()
+        next_sample = 0.0
+        self._sample(shell, 0.0)
+
+        while time.time() - start < duration:
+            for line in self.script:
+                t = time.time()
+                shell.onecmd(line)
+                self.latencies.setdefault(line, []).append(time.time() - t)
+                self.commands += 1
+
+                elapsed = time.time() - start
+                if elapsed >= next_sample:
+                    self._sample(shell, elapsed)
+                    next_sample = elapsed + self.sample_interval
+                if elapsed >= duration:
+                    break
+
+            if not self.warmup_sample:
+                self._sample(shell, time.time() - start)
+                self.warmup_sample = len(self.samples) - 1
+
+        self.elapsed = time.time() - start
+        self._sample(shell, self.elapsed)
+
+    def report(self, out=sys.stdout):
+        mb = lambda b: b / (1024.0 * 1024.0)
+        print >>out, "commands: %d in %.1fs (%.1f/s), %d HTTP requests" % (
+            self.commands, self.elapsed, self.throughput,
+            self.server.requests)
+
+        print >>out
+        print >>out, "%-45s %7s %9s %9s %9s" % (
+            "command", "count", "p50 ms", "p99 ms", "max ms")
+        for command in sorted(self.latencies):
+            values = self.latencies[command]
+            print >>out, "%-45s %7d %9.1f %9.1f %9.1f" % (
+                command[:45], len(values), percentile(values, 50) * 1000,
+                percentile(values, 99) * 1000, max(values) * 1000)
+
+        print >>out
+        print >>out, "%9s %9s %9s %9s" % ("time s", "RSS MB",
+                                          "stories", "tags")
+        for elapsed, rss, stories, tags in self.samples:
+            print >>out, "%9.1f %9.1f %9d %9s" % (
+                elapsed, mb(rss), stories, "-" if tags is None else tags)
+
+    @property
+    def throughput(self):
+        return self.commands / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def p99(self):
+        ''' Worst 99th percentile latency among all commands. '''
+        return max(percentile(v, 99) for v in self.latencies.values())
+
+    @property
+    def rss_growth(self):
+        ''' Growth of RSS from the first sample after warm-up
+        (i.e. after the first pass over the script) till the end.
+        '''
+        return self.samples[-1][1] - self.samples[self.warmup_sample][1]
+
+    def failures(self, max_p99=None, max_rss=None, max_rss_growth=None,
+                 min_throughput=None):
+        ''' Checks measurements against thresholds (latency in ms,
+        memory in MB), returning list of descriptions of failed checks.
+        '''
+        res = []
+        mb = 1024 * 1024
+        if max_p99 is not None and self.p99 * 1000 > max_p99:
+            res.append("p99 latency %.1f ms > %s ms" % (self.p99 * 1000,
+                                                        max_p99))
+        peak = max(s[1] for s in self.samples)
+        if max_rss is not None and peak > max_rss * mb:
+            res.append("peak RSS %.1f MB > %s MB" % (peak / float(mb),
+                                                     max_rss))
+        if (max_rss_growth is not None
+                and self.rss_growth > max_rss_growth * mb):
+            res.append("RSS growth %.1f MB > %s MB" % (
+                self.rss_growth / float(mb), max_rss_growth))
+        if min_throughput is not None and self.throughput < min_throughput:
+            res.append("throughput %.1f/s < %s/s" % (self.throughput,
+                                                     min_throughput))
+        return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--duration', type=float, default=60,
+                        help="how long to run, in seconds")
+    parser.add_argument('--script', action='append', metavar='COMMANDS',
+                        help="shell command line to run in the loop "
+                             "(may be given multiple times)")
+    parser.add_argument('--page-size', type=int, default=30,
+                        help="number of stories on every listing")
+    parser.add_argument('--comments', type=int, default=50,
+                        help="number of comments on every story")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated server latency, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help="random variation of latency, as fraction")
+    parser.add_argument('--sample-interval', type=float, default=5.0,
+                        help="how often to measure memory, in seconds")
+    parser.add_argument('--track-tags', action='store_true',
+                        help="count live BeautifulSoup tags in samples")
+    parser.add_argument('--max-p99', type=float, metavar='MS')
+    parser.add_argument('--max-rss', type=float, metavar='MB')
+    parser.add_argument('--max-rss-growth', type=float, metavar='MB')
+    parser.add_argument('--min-throughput', type=float, metavar='CMDS')
+    args = parser.parse_args()
+
+    server = SimulatedHN(page_size=args.page_size, comments=args.comments,
+                         latency=args.latency, jitter=args.jitter).start()
+    try:
+        soak = Soak(server, args.script or DEFAULT_SCRIPT,
+                    sample_interval=args.sample_interval,
+                    track_tags=args.track_tags)
+        soak.run(args.duration)
+    finally:
+        server.stop()
+
+    soak.report()
+    failures = soak.failures(args.max_p99, args.max_rss,
+                             args.max_rss_growth, args.min_throughput)
+    if failures:
+        print
+        for failure in failures:
+            print "FAILED: " + failure
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()